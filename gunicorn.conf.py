@@ -0,0 +1,7 @@
+# Loaded automatically by `gunicorn main:app` from the working directory.
+# Threaded workers keep serving while other requests wait on Open-Meteo;
+# each thread reuses its own pooled SQLite connection from connect_db().
+worker_class = 'gthread'
+workers = 2
+threads = 8
+timeout = 30
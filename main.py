@@ -1,13 +1,31 @@
 import logging
 import sqlite3
-from datetime import datetime, date
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import lru_cache
+from itertools import accumulate
+from types import MappingProxyType
 import requests
-from flask import Flask, request, jsonify, render_template_string, redirect, url_for
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, request, redirect, url_for
+from flask_compress import Compress
+from orjson import dumps as _odumps
 
 app = Flask(__name__)
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html']
+app.config['COMPRESS_LEVEL'] = 6
+Compress(app)
 logging.basicConfig(level=logging.INFO)
 DB_PATH = 'plant_watering.db'
 
+def _ojson(obj, status=200):
+    return app.response_class(_odumps(obj), status=status, mimetype='application/json')
+
 # --------------------------- CROP PROFILES ---------------------------
 CROP_PROFILES = {
     'banana': {'display': 'Banana','stages': [{'name': 'Initial','days': 30,'kc': 0.6},{'name': 'Development','days': 90,'kc': 0.9},{'name': 'Mid-Season','days': 150,'kc': 1.05},{'name': 'Late-Season','days': 60,'kc': 0.8}]},
@@ -16,6 +34,19 @@ CROP_PROFILES = {
     'potato': {'display': 'Potato','stages': [{'name': 'Initial','days': 15,'kc': 0.7},{'name': 'Development','days': 45,'kc': 1.05},{'name': 'Mid-Season','days': 30,'kc': 1.0},{'name': 'Late-Season','days': 20,'kc': 0.8}]},
     'cardamom': {'display': 'Cardamom','stages': [{'name': 'Initial','days': 30,'kc': 0.6},{'name': 'Development','days': 60,'kc': 0.85},{'name': 'Mid-Season','days': 120,'kc': 1.0},{'name': 'Late-Season','days': 60,'kc': 0.85}]}
 }
+# Read-only views: these tables are constants shared by every request thread.
+CROP_PROFILES = MappingProxyType({
+    key: MappingProxyType({**profile, 'stages': tuple(MappingProxyType(stage) for stage in profile['stages'])})
+    for key, profile in CROP_PROFILES.items()
+})
+
+# Per-crop (cumulative stage end days, kc values, stage names), built once at import.
+_STAGE_TABLE = {
+    key: (tuple(accumulate(stage['days'] for stage in profile['stages'])),
+          tuple(stage['kc'] for stage in profile['stages']),
+          tuple(stage['name'] for stage in profile['stages']))
+    for key, profile in CROP_PROFILES.items()
+}
 
 TRANSLATIONS = {
     'en': {'title': 'Smart Irrigation Dashboard', 'choose_crop': 'Choose Crop', 'sow_date': 'Sowing Date','submit': 'Submit', 'lang': 'Language'},
@@ -23,13 +54,41 @@ TRANSLATIONS = {
     'si': {'title': 'Smart Irrigation Dashboard (Sikkimese)', 'choose_crop': 'Crop चुन्नुहोस्','sow_date': 'रोपाइ मिति', 'submit': 'पेश गर्नुहोस्', 'lang': 'भाषा'},
     'ta': {'title': 'அறிவார்ந்த நீர்ப்பாசன கட்டுப்பாடு', 'choose_crop': 'பயிர் தேர்ந்தெடுக்கவும்','sow_date': 'விதைத்த தேதி', 'submit': 'சமர்ப்பி', 'lang': 'மொழி'}
 }
+TRANSLATIONS = MappingProxyType({lang: MappingProxyType(strings) for lang, strings in TRANSLATIONS.items()})
 
+@lru_cache(maxsize=512)
 def t(key, lang='en'):
     return TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, key)
 
+# DATE columns round-trip as date objects through explicit ISO adapters.
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter('DATE', lambda value: date.fromisoformat(value.decode()))
+
+# --------------------------- SQL ---------------------------
+SQL_LATEST_SENSOR = 'SELECT soil_moisture, temperature, humidity, timestamp FROM sensors WHERE id = (SELECT MAX(id) FROM sensors)'
+SQL_LATEST_TANK = 'SELECT level_percent, timestamp FROM tank_levels WHERE id = (SELECT MAX(id) FROM tank_levels)'
+SQL_FIELDS = 'SELECT crop, sow_date, area, soil_depth FROM fields WHERE id = 1'
+SQL_UPSERT_FIELDS = ('INSERT INTO fields (id, crop, sow_date, area, soil_depth) VALUES (1, ?, ?, ?, ?) '
+                     'ON CONFLICT(id) DO UPDATE SET crop=excluded.crop, sow_date=excluded.sow_date, '
+                     'area=excluded.area, soil_depth=excluded.soil_depth')
+SQL_INSERT_SENSOR = 'INSERT INTO sensors (soil_moisture, temperature, humidity) VALUES (?, ?, ?)'
+SQL_INSERT_TANK = 'INSERT INTO tank_levels (level_percent) VALUES (?)'
+
+# One long-lived connection per worker thread instead of a fresh open() per request.
+_local = threading.local()
+
 def connect_db():
-    conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
-    conn.row_factory = sqlite3.Row
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        # IMMEDIATE takes the write lock up front, so a writer never fails upgrading from a read lock.
+        conn = sqlite3.connect(DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+                               check_same_thread=False, isolation_level='IMMEDIATE', cached_statements=256)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA wal_autocheckpoint=1000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-64000')
+        _local.conn = conn
     return conn
 
 def init_db():
@@ -40,91 +99,103 @@ def init_db():
     c.execute('''CREATE TABLE IF NOT EXISTS fields (id INTEGER PRIMARY KEY AUTOINCREMENT,crop TEXT,sow_date DATE,area REAL DEFAULT 10.0,soil_depth REAL DEFAULT 0.2)''')
     c.execute('''CREATE TABLE IF NOT EXISTS tank_levels (id INTEGER PRIMARY KEY AUTOINCREMENT,level_percent REAL,timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
     conn.commit()
-    conn.close()
 
 init_db()
 
-def calculate_dynamic_kc_for_crop(crop_key, sow_date, current_date=None):
+# current_date is required so the cache key changes with the day.
+@lru_cache(maxsize=1024)
+def calculate_dynamic_kc_for_crop(crop_key, sow_date, current_date):
     if crop_key not in CROP_PROFILES:
         crop_key = 'maize'
-    if current_date is None:
-        current_date = datetime.now().date()
     days_elapsed = (current_date - sow_date).days
     if days_elapsed < 0:
         days_elapsed = 0
-    profile = CROP_PROFILES[crop_key]
-    cumulative = 0
-    for stage in profile['stages']:
-        cumulative += stage['days']
-        if days_elapsed <= cumulative:
-            return stage['kc'], stage['name'], days_elapsed
-    last = profile['stages'][-1]
-    return last['kc'], last['name'], days_elapsed
-
-def get_et0_from_openmeteo(latitude, longitude):
+    cum_days, kcs, names = _STAGE_TABLE[crop_key]
+    i = min(bisect_left(cum_days, days_elapsed), len(cum_days) - 1)
+    return kcs[i], names[i], days_elapsed
+
+# Shared keep-alive session so Open-Meteo calls reuse pooled TLS connections.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=Retry(total=2, backoff_factor=0.2)))
+
+# Background workers so the forecast fetch overlaps with the request's DB reads.
+_IO_POOL = ThreadPoolExecutor(max_workers=8)
+
+# Open-Meteo responses are cached per rounded coordinate for one hour; failures are not cached.
+WEATHER_TTL_SECONDS = 3600
+
+@lru_cache(maxsize=64)
+def _forecast_url(latitude, longitude):
+    return f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&hourly=et0_fao_evapotranspiration&daily=precipitation_sum,temperature_2m_max&timezone=auto"
+
+@lru_cache(maxsize=512)
+def _fetch_forecast(latitude, longitude, ttl_hash):
+    response = SESSION.get(_forecast_url(latitude, longitude), timeout=(2, 5))
+    response.raise_for_status()
+    return response.json()
+
+def get_forecast(latitude, longitude):
+    return _fetch_forecast(round(latitude, 2), round(longitude, 2), int(time.time() // WEATHER_TTL_SECONDS))
+
+def get_weather(latitude, longitude):
+    # One fetch yields both ET0 and the daily block, so a failing fetch is only paid once.
     try:
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&hourly=et0_fao_evapotranspiration&timezone=auto"
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        return float(data['hourly']['et0_fao_evapotranspiration'][0])
+        data = get_forecast(latitude, longitude)
     except Exception:
-        return 3.0
-
-def get_daily_weather_forecast(latitude, longitude):
+        return 3.0, {}
     try:
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&daily=precipitation_sum,temperature_2m_max&timezone=auto"
-        response = requests.get(url, timeout=5)
-        return response.json().get('daily', {})
+        et0 = float(data['hourly']['et0_fao_evapotranspiration'][0])
     except Exception:
-        return {}
+        et0 = 3.0
+    return et0, data.get('daily', {})
+
+Sensor = namedtuple('Sensor', 'soil_moisture temperature humidity timestamp')
+TankLevel = namedtuple('TankLevel', 'level_percent timestamp')
+Field = namedtuple('Field', 'crop sow_date area soil_depth')
 
 def get_sensor_data():
     conn = connect_db()
-    row = conn.execute('SELECT soil_moisture, temperature, humidity, timestamp FROM sensors ORDER BY timestamp DESC LIMIT 1').fetchone()
-    conn.close()
-    return dict(row) if row else {'soil_moisture': 0, 'temperature': 0, 'humidity': 0, 'timestamp': None}
+    row = conn.execute(SQL_LATEST_SENSOR).fetchone()
+    return Sensor(*row) if row else Sensor(0, 0, 0, None)
 
 def get_latest_tank_level():
     conn = connect_db()
-    row = conn.execute('SELECT level_percent, timestamp FROM tank_levels ORDER BY timestamp DESC LIMIT 1').fetchone()
-    conn.close()
-    return dict(row) if row else {'level_percent': None, 'timestamp': None}
+    row = conn.execute(SQL_LATEST_TANK).fetchone()
+    return TankLevel(*row) if row else TankLevel(None, None)
+
+def get_field_settings():
+    conn = connect_db()
+    row = conn.execute(SQL_FIELDS).fetchone()
+    return Field(*row) if row else Field('banana', date.today(), 10, 0.2)
 
 def calculate_water_amount(soil_moisture, area, soil_depth, predicted_rainfall, et0, kc, humidity, field_capacity=30):
-    etc = et0 * kc
-    soil_depth_mm = soil_depth * 1000
-    current_moisture_mm = (soil_moisture / 100.0) * soil_depth_mm
-    water_deficit_mm = max(0.0, etc - current_moisture_mm / area - predicted_rainfall)
+    current_moisture_mm = (soil_moisture / 100.0) * (soil_depth * 1000)
+    water_deficit_mm = et0 * kc - current_moisture_mm / area - predicted_rainfall
+    if water_deficit_mm <= 0:
+        return 0
     if humidity < 30:
         water_deficit_mm *= 1.2
     elif humidity > 80:
         water_deficit_mm *= 0.9
-    return max(0, int(round(water_deficit_mm * area)))
+    return max(0, round(water_deficit_mm * area))
 
 # ---------------- API ENDPOINTS ----------------
 
 @app.route('/api/watering_decision', methods=['GET'])
 def watering_decision():
+    lat, lon = 27.2, 88.03
+    weather_future = _IO_POOL.submit(get_weather, lat, lon)
+
     sensor = get_sensor_data()
-    soil = sensor['soil_moisture']
-    humidity = sensor['humidity']
-    temperature = sensor['temperature']
+    soil = sensor.soil_moisture
+    humidity = sensor.humidity
+    temperature = sensor.temperature
 
-    conn = connect_db()
-    row = conn.execute("SELECT crop, sow_date, area, soil_depth FROM fields LIMIT 1").fetchone()
-    conn.close()
+    crop, sow_date, area, soil_depth = get_field_settings()
     
-    crop = row['crop'] if row else 'banana'
-    sow_date = row['sow_date'] if row else str(date.today())
-    sow_date = datetime.strptime(sow_date, '%Y-%m-%d').date() if isinstance(sow_date, str) else sow_date
-    area = row['area'] if row else 10
-    soil_depth = row['soil_depth'] if row else 0.2
-    
-    lat, lon = 27.2, 88.03
-    weather = get_daily_weather_forecast(lat, lon)
-    et0 = get_et0_from_openmeteo(lat, lon)
-    kc, stage_name, days_elapsed = calculate_dynamic_kc_for_crop(crop, sow_date)
-    predicted_rain = float(weather.get('precipitation_sum', [0, 0])[1])
+    et0, weather = weather_future.result()
+    kc, stage_name, days_elapsed = calculate_dynamic_kc_for_crop(crop, sow_date, date.today())
+    predicted_rain = weather.get('precipitation_sum', [0.0, 0.0])[1] or 0.0
     
     water_amount = calculate_water_amount(soil, area, soil_depth, predicted_rain, et0, kc, humidity)
     
@@ -139,7 +210,11 @@ def watering_decision():
         'rain_forecast': predicted_rain,
         'water_amount_liters': water_amount
     }
-    return jsonify(result)
+    response = _ojson(result)
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/api/send_sensor', methods=['POST'])
 def receive_sensor_data():
@@ -149,14 +224,13 @@ def receive_sensor_data():
     hum = data.get('humidity')
     tank = data.get('tank_level')
     if None in [soil, temp, hum, tank]:
-        return jsonify({'error': 'Missing fields'}), 400
+        return _ojson({'error': 'Missing fields'}, 400)
     conn = connect_db()
-    c = conn.cursor()
-    c.execute("INSERT INTO sensors (soil_moisture, temperature, humidity) VALUES (?, ?, ?)", (soil, temp, hum))
-    c.execute("INSERT INTO tank_levels (level_percent) VALUES (?)", (tank,))
-    conn.commit()
-    conn.close()
-    return jsonify({'status': 'success'}), 200
+    # The connection outlives the request, so a failed write must roll back and release the lock.
+    with conn:
+        conn.execute(SQL_INSERT_SENSOR, (soil, temp, hum))
+        conn.execute(SQL_INSERT_TANK, (tank,))
+    return _ojson({'status': 'success'})
 
 # ---------------- DASHBOARD ----------------
 
@@ -187,43 +261,29 @@ INDEX_HTML = """
   </body>
 </html>
 """
+_INDEX_TMPL = app.jinja_env.from_string(INDEX_HTML)
 
 @app.route('/', methods=['GET', 'POST'])
 def set_field():
     lang = request.form.get('lang', request.args.get('lang', 'en'))
-    conn = connect_db()
-    c = conn.cursor()
-    c.execute("SELECT crop, sow_date, area, soil_depth FROM fields LIMIT 1")
-    row = c.fetchone()
-    crop = row['crop'] if row else 'banana'
-    sow_date = row['sow_date'] if row else str(date.today())
-    area = row['area'] if row else 10
-    soil_depth = row['soil_depth'] if row else 0.2
     if request.method == 'POST':
         crop = request.form['crop']
-        sow_date = request.form['sow_date']
+        sow_date = date.fromisoformat(request.form['sow_date'])
         area = float(request.form['area'])
         soil_depth = float(request.form['soil_depth'])
-        c.execute("SELECT id FROM fields LIMIT 1")
-        exists = c.fetchone()
-        if exists:
-            c.execute("UPDATE fields SET crop=?, sow_date=?, area=?, soil_depth=? WHERE id=?",
-                      (crop, sow_date, area, soil_depth, exists['id']))
-        else:
-            c.execute("INSERT INTO fields (crop, sow_date, area, soil_depth) VALUES (?, ?, ?, ?)",
-                      (crop, sow_date, area, soil_depth))
-        conn.commit()
-        conn.close()
+        # The fields table holds a single row pinned at id=1.
+        conn = connect_db()
+        with conn:
+            conn.execute(SQL_UPSERT_FIELDS, (crop, sow_date, area, soil_depth))
         return redirect(url_for('set_field', lang=lang))
-    conn.close()
-    return render_template_string(INDEX_HTML,
-                                  t=lambda key: t(key, lang),
-                                  crops=CROP_PROFILES,
-                                  current_crop=crop,
-                                  sow_date=sow_date,
-                                  area=area,
-                                  soil_depth=soil_depth,
-                                  lang=lang)
+    crop, sow_date, area, soil_depth = get_field_settings()
+    return _INDEX_TMPL.render(t=lambda key: t(key, lang),
+                              crops=CROP_PROFILES,
+                              current_crop=crop,
+                              sow_date=sow_date,
+                              area=area,
+                              soil_depth=soil_depth,
+                              lang=lang)
 
 if __name__ == '__main__':
     app.run(debug=True)